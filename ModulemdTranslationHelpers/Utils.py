@@ -12,16 +12,122 @@
 # <https://www.gnu.org/philosophy/free-sw.en.html>.
 
 import sys
+import os
+import gzip
+import csv
+import json
+import time
+import hashlib
+import tempfile
 import logging
+import xmlrpc.client
 import gi
 import requests
 from babel.messages import Catalog, pofile
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 gi.require_version('Modulemd', '2.0')  # noqa
+from gi.repository import GLib
 from gi.repository import Modulemd
 
+COVERAGE_STATES = ("translated", "fuzzy", "missing")
+
+TranslationString = namedtuple(
+    "TranslationString",
+    ["locale", "module_name", "stream_name", "string_type", "profile_name",
+     "string", "state"])
+
+
+def _get_recorded_call_path(directory, method, args):
+    """
+    Get the path of the file holding the response to a Koji RPC call.
+    :param directory: The directory containing the recorded calls
+    :param method: The name of the RPC method
+    :param args: The positional arguments passed to the method
+    :return: The path to a gzip-compressed JSON file
+    """
+    key = json.dumps([method, list(args)], sort_keys=True)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(directory, "%s-%s.json.gz" % (method, digest))
+
+
+class RecordingSession(object):
+    """
+    Wraps a Koji session and stores the response of every RPC call made
+    through it in a directory, so it can be served back by ReplaySession.
+    XML-RPC faults are stored as well and raised again on replay.
+    """
+
+    def __init__(self, session, directory):
+        self._session = session
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def __getattr__(self, method):
+        def _call(*args):
+            try:
+                response = getattr(self._session, method)(*args)
+            except xmlrpc.client.Fault as fault:
+                self._record(method, args, {
+                    'fault': {'faultCode': fault.faultCode,
+                              'faultString': fault.faultString}})
+                raise
+
+            self._record(method, args, {'result': response})
+            return response
+        return _call
+
+    def _record(self, method, args, record):
+        path = _get_recorded_call_path(self._directory, method, args)
+
+        # Several threads may record the same call, so write to a
+        # temporary file and move it into place.
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory)
+        try:
+            with os.fdopen(fd, 'wb') as rawfile:
+                with gzip.open(rawfile, 'wt', encoding='utf-8') as outfile:
+                    # xmlrpc.client.DateTime is not JSON-serializable;
+                    # nothing we consume relies on it, so store its string
+                    # form.
+                    json.dump(record, outfile, default=str)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class ReplaySession(object):
+    """
+    Serves back Koji RPC responses stored by RecordingSession, optionally
+    sleeping before each one to simulate network latency.
+    """
+
+    def __init__(self, directory, latency=0.0):
+        self._directory = directory
+        self._latency = latency
+
+    def __getattr__(self, method):
+        def _call(*args):
+            path = _get_recorded_call_path(self._directory, method, args)
+            if not os.path.isfile(path):
+                raise KeyError(
+                    "No recorded response for %s%r in %s" %
+                    (method, tuple(args), self._directory))
+
+            if self._latency:
+                time.sleep(self._latency)
+
+            with gzip.open(path, 'rt', encoding='utf-8') as infile:
+                record = json.load(infile)
+
+            if 'fault' in record:
+                raise xmlrpc.client.Fault(record['fault']['faultCode'],
+                                          record['fault']['faultString'])
+
+            return record['result']
+        return _call
+
 
 def get_latest_modules_in_tag(session, tag):
     """
@@ -108,7 +214,14 @@ def get_index_from_tags(session, tags):
     return index
 
 
-def get_translation_catalog_from_index(index, project_name):
+def get_translatable_strings_from_index(index):
+    """
+    Get the translatable strings of the highest version of each stream in a
+    ModuleIndex.
+    :param index: A ModuleIndex object
+    :return: A list of (module_name, stream_name, string_type, profile_name,
+    string) tuples. The profile_name is None for summaries and descriptions.
+    """
     # Get all Modulemd.Module object names
     module_names = index.get_module_names()
 
@@ -125,25 +238,23 @@ def get_translation_catalog_from_index(index, project_name):
             stream = module.search_streams(stream_name, 0)[0]
             final_streams.append(stream)
 
-    # A dictionary to store:
-    # key: all translatable strings
-    # value: their respective locations
-    translation_dict = defaultdict(list)
+    strings = list()
 
     for stream in final_streams:
+        module_name = stream.props.module_name
+        stream_name = stream.props.stream_name
+
         # Process description
         description = stream.get_description("C")
         if description is not None:
-            location = (("{};{};description").format(
-                stream.props.module_name, stream.props.stream_name), 2)
-            translation_dict[description].append(location)
+            strings.append((module_name, stream_name, "description", None,
+                            description))
 
         # Process summary
         summary = stream.get_summary("C")
         if summary is not None:
-            location = (("{};{};summary").format(
-                stream.props.module_name, stream.props.stream_name), 1)
-            translation_dict[summary].append(location)
+            strings.append((module_name, stream_name, "summary", None,
+                            summary))
 
         # Process profile descriptions(sometimes NULL)
         profile_names = stream.get_profile_names()
@@ -152,9 +263,30 @@ def get_translation_catalog_from_index(index, project_name):
                 profile = stream.get_profile(pro_name)
                 profile_desc = profile.get_description("C")
                 if profile_desc is not None:
-                    location = (("{};{};profile;{}").format(
-                        stream.props.module_name, stream.props.stream_name, pro_name), 3)
-                    translation_dict[profile_desc].append(location)
+                    strings.append((module_name, stream_name, "profile",
+                                    pro_name, profile_desc))
+
+    return strings
+
+
+def get_translation_catalog_from_index(index, project_name):
+    # A dictionary to store:
+    # key: all translatable strings
+    # value: their respective locations
+    translation_dict = defaultdict(list)
+
+    for (module_name, stream_name, string_type, profile_name,
+         string) in get_translatable_strings_from_index(index):
+        if string_type == "description":
+            location = (("{};{};description").format(
+                module_name, stream_name), 2)
+        elif string_type == "summary":
+            location = (("{};{};summary").format(
+                module_name, stream_name), 1)
+        else:
+            location = (("{};{};profile;{}").format(
+                module_name, stream_name, profile_name), 3)
+        translation_dict[string].append(location)
 
     catalog = Catalog(project=project_name)
 
@@ -165,52 +297,147 @@ def get_translation_catalog_from_index(index, project_name):
     return catalog
 
 
-def get_modulemd_translations_from_catalog(catalogs, index):
-    # Dictionary `translations` contains information from catalog like:
-    # Key: (module_name, stream_name)
-    # Value: Translation object containing TranslationEntry of various locales
-    translations = dict()
+def get_translation_keys_from_index(index):
+    """
+    Get the set of translatable locations present in a ModuleIndex.
+    :param index: A ModuleIndex object
+    :return: A set of (module_name, stream_name, profile_name) tuples. The
+    profile_name is None for summaries and descriptions.
+    """
+    keys = set()
 
-    now = datetime.utcnow()
-    modified = int(now.strftime("%Y%m%d%H%M%S"))
+    for module_name in index.get_module_names():
+        module = index.get_module(module_name)
+
+        for stream_name in module.get_stream_names():
+            keys.add((module_name, stream_name, None))
+
+            for stream in module.search_streams(stream_name, 0):
+                for profile_name in stream.get_profile_names() or []:
+                    keys.add((module_name, stream_name, profile_name))
+
+    return keys
+
+
+def get_translation_table_from_catalogs(catalogs):
+    """
+    Flatten a set of catalogs into a table of translated strings. The table
+    is immutable, so it can be parsed once and shared between threads adding
+    the translations to several ModuleIndex objects.
+    :param catalogs: An iterable of babel.messages.Catalog objects
+    :return: A tuple of TranslationString objects
+    """
+    table = list()
 
-    # Handling one language translations at a time
     for catalog in catalogs:
-        # Dictionary `data` contains information from catalog like:
-        # Key: (module_name, stream_name)
-        # Value: TranslationEntry object of a locale
-        data = dict()
+        locale = str(catalog.locale)
 
         for msg in catalog:
+            if not msg.string:
+                state = "missing"
+            elif msg.fuzzy:
+                state = "fuzzy"
+            else:
+                state = "translated"
+
             for location, _ in msg.locations:
                 (module_name, stream_name, string_type,
                  profile_name) = split_location(location)
 
-                try:
-                    entry = data[(module_name, stream_name)]
-                except KeyError:
-                    entry = Modulemd.TranslationEntry.new(
-                        str(catalog.locale))
+                table.append(TranslationString(
+                    locale, module_name, stream_name, string_type,
+                    profile_name, msg.string, state))
 
-                if string_type == "summary":
-                    entry.set_summary(msg.string)
-                elif string_type == "description":
-                    entry.set_description(msg.string)
-                else:
-                    entry.set_profile_description(profile_name, msg.string)
+    return tuple(table)
 
-                data[(module_name, stream_name)] = entry
 
-        for (module_name, stream_name), entry in data.items():
-            try:
-                mmd_translation = translations[(module_name, stream_name)]
-            except KeyError:
-                mmd_translation = Modulemd.Translation.new(
-                    1, module_name, stream_name, modified)
+def add_translations_to_index(table, index, prune=False):
+    """
+    Add the translations from a table of translated strings to a ModuleIndex.
+    :param table: A table returned by get_translation_table_from_catalogs()
+    :param index: The ModuleIndex object to add the translations to
+    :param prune: If True, skip strings for modules, streams or profiles that
+    are not present in the index instead of trying to add them.
+    :return: The translation coverage of the strings in the index, as a
+    dictionary keyed by locale, then module name, then string type
+    ("summary", "description" or "profile"), holding the number of
+    "translated", "fuzzy" and "missing" strings. Strings of the index with no
+    entry in the table count as "missing"; entries of the table for strings
+    that are not in the index are not counted.
+    """
+    # Dictionary `translations` contains information from catalog like:
+    # Key: (module_name, stream_name)
+    # Value: Translation object containing TranslationEntry of various locales
+    translations = dict()
+
+    # Dictionary `data` contains information from catalog like:
+    # Key: (locale, module_name, stream_name)
+    # Value: TranslationEntry object of a locale
+    data = dict()
+
+    # Dictionary `states` contains information from the table like:
+    # Key: locale
+    # Value: dictionary of the state of each string of the index, keyed by
+    # (module_name, stream_name, string_type, profile_name)
+    states = dict()
+    index_strings = set(
+        (module_name, stream_name, string_type, profile_name)
+        for (module_name, stream_name, string_type, profile_name, _)
+        in get_translatable_strings_from_index(index))
 
-            mmd_translation.set_translation_entry(entry)
+    pruned = defaultdict(int)
+
+    if prune:
+        valid_keys = get_translation_keys_from_index(index)
+
+    now = datetime.utcnow()
+    modified = int(now.strftime("%Y%m%d%H%M%S"))
+
+    for string in table:
+        locale_states = states.setdefault(string.locale, dict())
+
+        if prune and (string.module_name, string.stream_name,
+                      string.profile_name) not in valid_keys:
+            logging.debug("Pruning %s;%s;%s for %s", string.module_name,
+                          string.stream_name, string.string_type,
+                          string.locale)
+            pruned[string.locale] += 1
+            continue
+
+        string_key = (string.module_name, string.stream_name,
+                      string.string_type, string.profile_name)
+        if string_key in index_strings:
+            locale_states[string_key] = string.state
+
+        key = (string.locale, string.module_name, string.stream_name)
+        try:
+            entry = data[key]
+        except KeyError:
+            entry = Modulemd.TranslationEntry.new(string.locale)
+            data[key] = entry
+
+        if string.string_type == "summary":
+            entry.set_summary(string.string)
+        elif string.string_type == "description":
+            entry.set_description(string.string)
+        else:
+            entry.set_profile_description(string.profile_name, string.string)
+
+    for locale, count in pruned.items():
+        logging.warning(
+            "Pruned %d %s strings for modules absent from the index",
+            count, locale)
+
+    for (locale, module_name, stream_name), entry in data.items():
+        try:
+            mmd_translation = translations[(module_name, stream_name)]
+        except KeyError:
+            mmd_translation = Modulemd.Translation.new(
+                1, module_name, stream_name, modified)
             translations[(module_name, stream_name)] = mmd_translation
 
+        mmd_translation.set_translation_entry(entry)
+
     for (module_name, stream_name), mmd_translation in translations.items():
         try:
             ret = index.add_translation(mmd_translation)
@@ -220,7 +447,54 @@ def get_modulemd_translations_from_catalog(catalogs, index):
                 module_name,
                 stream_name)
 
-    return None
+    coverage = defaultdict(lambda: defaultdict(lambda: defaultdict(
+        lambda: dict.fromkeys(COVERAGE_STATES, 0))))
+    for locale, locale_states in states.items():
+        for (module_name, stream_name, string_type,
+             profile_name) in index_strings:
+            state = locale_states.get(
+                (module_name, stream_name, string_type, profile_name),
+                "missing")
+            coverage[locale][module_name][string_type][state] += 1
+
+    return coverage
+
+
+def get_modulemd_translations_from_catalog(catalogs, index, prune=False):
+    """
+    Add the translations from a set of catalogs to a ModuleIndex.
+    :param catalogs: An iterable of babel.messages.Catalog objects
+    :param index: The ModuleIndex object to add the translations to
+    :param prune: If True, skip strings for modules, streams or profiles that
+    are not present in the index instead of trying to add them.
+    :return: The translation coverage, see add_translations_to_index()
+    """
+    return add_translations_to_index(
+        get_translation_table_from_catalogs(catalogs), index, prune)
+
+
+def write_translation_coverage(coverage, outfile, output_format="json"):
+    """
+    Write the translation coverage returned by add_translations_to_index()
+    to a file.
+    :param coverage: The translation coverage dictionary
+    :param outfile: A file object opened for writing text
+    :param output_format: Either "json" or "csv"
+    :return: None
+    """
+    if output_format == "json":
+        json.dump(coverage, outfile, indent=2, sort_keys=True)
+        return
+
+    writer = csv.writer(outfile)
+    writer.writerow(["locale", "module", "string_type"] +
+                    list(COVERAGE_STATES))
+    for locale in sorted(coverage):
+        for module_name in sorted(coverage[locale]):
+            for string_type in sorted(coverage[locale][module_name]):
+                counts = coverage[locale][module_name][string_type]
+                writer.writerow([locale, module_name, string_type] +
+                                [counts[state] for state in COVERAGE_STATES])
 
 
 def split_location(location):
@@ -13,4 +13,6 @@
 
 from ModulemdTranslationHelpers.Utils import get_translation_catalog_from_index
 from ModulemdTranslationHelpers.Utils import get_modulemd_translations_from_catalog
+from ModulemdTranslationHelpers.Utils import get_translation_table_from_catalogs
+from ModulemdTranslationHelpers.Utils import add_translations_to_index
 import ModulemdTranslationHelpers.Fedora
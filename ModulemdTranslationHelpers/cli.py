@@ -14,10 +14,14 @@
 from __future__ import print_function
 
 import click
+import concurrent.futures
+import contextlib
+import cProfile
 import gi
 import os
 import os.path
 import logging
+import tracemalloc
 import xmlrpc.client
 import Utils
 import Fedora
@@ -47,20 +51,151 @@ from gi.repository import Modulemd
               help="The distribution release",
               metavar="<branch_name>")
 
+@click.option('--record', default=None,
+              type=click.Path(file_okay=False, dir_okay=True, writable=True),
+              help="Store every Koji response in this directory so the run "
+                   "can be replayed later.",
+              metavar="<DIR>")
+
+@click.option('--replay', default=None,
+              type=click.Path(exists=True, file_okay=False, dir_okay=True,
+                              readable=True),
+              help="Serve Koji responses from a directory written by "
+                   "--record instead of contacting Koji.",
+              metavar="<DIR>")
+
+@click.option('--replay-latency', default=0.0, type=float,
+              help="Seconds to wait before each replayed Koji response.",
+              show_default=True,
+              metavar="<SECONDS>")
+
+@click.option('--profile', default=None,
+              type=click.Path(dir_okay=False),
+              help="Write cProfile statistics for each stage of the "
+                   "subcommand to <FILE>.<stage>.",
+              metavar="<FILE>")
+
+@click.option('--trace-memory/--no-trace-memory', default=False,
+              help="Report the top memory allocation sites for each stage "
+                   "of the subcommand.")
+
 @click.pass_context
-def cli(ctx, debug, branch, koji_url):
+def cli(ctx, debug, branch, koji_url, record, replay, replay_latency,
+        profile, trace_memory):
     """Tools for managing modularity translations."""
 
     ctx.obj = dict()
     if debug:
       logging.basicConfig(level=logging.DEBUG)
 
-    ctx.obj['session'] = xmlrpc.client.ServerProxy(koji_url)
+    ctx.obj['profile'] = profile
+    ctx.obj['profilers'] = dict()
+    if profile:
+        ctx.call_on_close(lambda: dump_profiles(ctx))
+
+    ctx.obj['trace_memory'] = trace_memory
+    if trace_memory:
+        tracemalloc.start()
+        ctx.call_on_close(tracemalloc.stop)
+
+    if record and replay:
+        raise click.UsageError(
+            "--record and --replay cannot be used together")
 
+    # ServerProxy objects cannot be shared between threads, so subcommands
+    # working on several branches concurrently create one session each.
+    def new_session():
+        if replay:
+            session = Utils.ReplaySession(replay, replay_latency)
+        else:
+            session = xmlrpc.client.ServerProxy(koji_url)
+
+        if record:
+            session = Utils.RecordingSession(session, record)
+
+        return session
+
+    ctx.obj['new_session'] = new_session
+    ctx.obj['session'] = new_session()
+
+    # Resolved by resolve_branch() when a subcommand needs it, so that
+    # subcommands given their own branches do not look up rawhide needlessly.
     ctx.obj['branch'] = branch
 
-    if branch == "rawhide":
-        ctx.obj['branch'] = Fedora.get_fedora_rawhide_version(ctx.obj['session'])
+
+def resolve_branch(ctx, branch):
+    """
+    Get the Fedora version a branch refers to, looking up rawhide in Koji
+    at most once.
+    :param ctx: The click context of the subcommand
+    :param branch: A branch name, possibly "rawhide"
+    :return: The branch name with rawhide replaced by its Fedora version
+    """
+    if branch != "rawhide":
+        return branch
+
+    if 'rawhide' not in ctx.obj:
+        ctx.obj['rawhide'] = Fedora.get_fedora_rawhide_version(
+            ctx.obj['session'])
+
+    return ctx.obj['rawhide']
+
+
+@contextlib.contextmanager
+def instrument(ctx, stage):
+    """
+    Profile a stage of a subcommand if --profile or --trace-memory were
+    requested.
+    :param ctx: The click context of the subcommand
+    :param stage: A short name for the stage, used to tell the results apart
+    """
+    profiler = None
+    if ctx.obj['profile']:
+        if stage not in ctx.obj['profilers']:
+            ctx.obj['profilers'][stage] = cProfile.Profile()
+        profiler = ctx.obj['profilers'][stage]
+        profiler.enable()
+
+    if ctx.obj['trace_memory']:
+        before = tracemalloc.take_snapshot()
+
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+
+        if ctx.obj['trace_memory']:
+            after = tracemalloc.take_snapshot()
+            stats = [stat for stat in filter_memory_snapshot(after).compare_to(
+                         filter_memory_snapshot(before), 'lineno')
+                     if stat.size_diff > 0]
+            click.echo("Top memory allocations during %s:" % stage, err=True)
+            for stat in stats[:10]:
+                click.echo("  %s" % stat, err=True)
+
+
+def filter_memory_snapshot(snapshot):
+    """
+    Remove tracemalloc's own allocations from a snapshot.
+    :param snapshot: A tracemalloc.Snapshot object
+    :return: A filtered tracemalloc.Snapshot object
+    """
+    return snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")))
+
+
+def dump_profiles(ctx):
+    """
+    Write the cProfile statistics gathered by instrument() to one file per
+    stage, named after the --profile option.
+    :param ctx: The click context of the main command
+    """
+    for stage, profiler in ctx.obj['profilers'].items():
+        path = "%s.%s" % (ctx.obj['profile'], stage)
+        profiler.dump_stats(path)
+        click.echo("Wrote %s profile to %s" % (stage, path), err=True)
 
 ##############################################################################
 # Subcommands                                                                #
@@ -93,14 +228,21 @@ def extract(ctx, pot_file, project_name):
     Extract translations from all modules included in a particular version of
     Fedora or EPEL.
     """
-    index = Utils.get_index_from_tags(
-      ctx.parent.obj['session'], Fedora.get_tags_for_fedora_branch(
-        ctx.parent.obj['branch']))
+    branch = resolve_branch(ctx, ctx.obj['branch'])
+
+    with instrument(ctx, "index"):
+        index = Utils.get_index_from_tags(
+          ctx.parent.obj['session'], Fedora.get_tags_for_fedora_branch(
+            branch))
 
-    catalog = Utils.get_translation_catalog_from_index(index, project_name)
-    pofile.write_po(pot_file, catalog, sort_by_file=True)
+    with instrument(ctx, "catalog"):
+        catalog = Utils.get_translation_catalog_from_index(index,
+                                                           project_name)
 
-    print("Wrote extracted strings for %s to %s" % (ctx.obj['branch'],
+    with instrument(ctx, "output"):
+        pofile.write_po(pot_file, catalog, sort_by_file=True)
+
+    print("Wrote extracted strings for %s to %s" % (branch,
                                                     pot_file.name))
 
 
@@ -119,37 +261,151 @@ def extract(ctx, pot_file, project_name):
 
 @click.option('-y', '--yaml-file',
               default='fedora-modularity-translations.yaml',
-              type=click.File(mode='wb', atomic=True, lazy=True),
+              type=click.Path(dir_okay=False, writable=True),
               show_default=True,
               metavar="<PATH>",
-              help="Path to the YAML file to hold the modified modulemd-index containing"
-                   "the translated strings.")
+              help="Path to the YAML file to hold the modified modulemd-index "
+                   "containing the translated strings. When several branches "
+                   "are given, \"{branch}\" is replaced by the branch name, "
+                   "or the branch name is appended to the file name.")
+
+@click.option('-c', '--coverage-file',
+              default=None,
+              type=click.Path(dir_okay=False, writable=True),
+              metavar="<PATH>",
+              help="Path to a file to hold per-locale and per-module "
+                   "translation coverage statistics. Branch names are "
+                   "handled as for --yaml-file.")
+
+@click.option('--coverage-format',
+              default='json',
+              type=click.Choice(['json', 'csv']),
+              show_default=True,
+              help="Format of the translation coverage statistics.")
+
+@click.option('--prune/--no-prune',
+              default=False,
+              show_default=True,
+              help="Skip translations for modules, streams and profiles that "
+                   "are not present in the branch.")
+
+@click.argument('branches', nargs=-1, metavar="[<branch_name>...]")
 
 @click.pass_context
-def generate_metadata(ctx, pofile_dir, yaml_file):
+def generate_metadata(ctx, pofile_dir, yaml_file, coverage_file,
+                      coverage_format, prune, branches):
     """
     Add translations to modulemd-index inplace.
+    Translations are added to the modules of each given branch, or of the
+    --branch option if none are given. The .po files are only read once and
+    the branches are processed concurrently.
     :return: 0 on successful creation of modulemd-translation,
     nonzero on failure.
     """
-    index = Utils.get_index_from_tags(
-      ctx.parent.obj['session'], Fedora.get_tags_for_fedora_branch(
-        ctx.parent.obj['branch']))
+    if not branches:
+        branches = [ctx.obj['branch']]
+
+    # Drop duplicates, such as rawhide and the version it resolves to,
+    # keeping the order the branches were given in.
+    resolved_branches = list()
+    for branch in branches:
+        branch = resolve_branch(ctx, branch)
+        if branch not in resolved_branches:
+            resolved_branches.append(branch)
+    branches = resolved_branches
 
     # Process all .po files in the provided directory
     translation_files = [f for f in os.listdir(pofile_dir) if
                          os.path.isfile((os.path.join(pofile_dir, f))) and
                          f.endswith(".po")]
 
-    catalogs = list()
-    for f in translation_files:
-      with open(f, 'r') as infile:
-        catalog = pofile.read_po(infile)
-        catalogs.append(catalog)
+    with instrument(ctx, "po"):
+        catalogs = list()
+        for f in translation_files:
+          with open(os.path.join(pofile_dir, f), 'r') as infile:
+            catalog = pofile.read_po(infile)
+            catalogs.append(catalog)
+
+        table = Utils.get_translation_table_from_catalogs(catalogs)
+
+    # Profilers and memory snapshots cannot tell threads apart, so process
+    # one branch at a time when instrumenting.
+    if ctx.obj['profile'] or ctx.obj['trace_memory']:
+        max_workers = 1
+    else:
+        max_workers = len(branches)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = [
+            executor.submit(
+                generate_branch_metadata, ctx, branch, table,
+                get_branch_path(yaml_file, branch, len(branches) > 1),
+                coverage_file and get_branch_path(
+                    coverage_file, branch, len(branches) > 1),
+                coverage_format, prune)
+            for branch in branches]
+
+        # Report from this thread so the messages are not interleaved
+        for branch, future in zip(branches, futures):
+            yaml_path, coverage_path = future.result()
+            print("Wrote modified modulemd-index YAML for %s to %s" %
+                  (branch, yaml_path))
+            if coverage_path:
+                print("Wrote translation coverage for %s to %s" %
+                      (branch, coverage_path))
+
+
+def get_branch_path(path, branch, multiple_branches):
+    """
+    Get the path of an output file for a branch.
+    :param path: The path given on the command line, optionally containing
+    "{branch}"
+    :param branch: The name of the branch
+    :param multiple_branches: Whether output is written for several branches
+    :return: The path with "{branch}" replaced by the branch name, or with the
+    branch name appended to the file name when there are several branches
+    """
+    if "{branch}" in path:
+        return path.replace("{branch}", branch)
+
+    if not multiple_branches:
+        return path
+
+    root, ext = os.path.splitext(path)
+    return "%s-%s%s" % (root, branch, ext)
+
+
+def generate_branch_metadata(ctx, branch, table, yaml_path, coverage_path,
+                             coverage_format, prune):
+    """
+    Add translations to the modulemd-index of a branch and write it out.
+    Runs in a worker thread, so it uses its own Koji session.
+    :param ctx: The click context of the subcommand
+    :param branch: The name of the branch
+    :param table: A table returned by get_translation_table_from_catalogs()
+    :param yaml_path: Path to the YAML file to write
+    :param coverage_path: Path to the coverage file to write, or None
+    :param coverage_format: Either "json" or "csv"
+    :param prune: Whether to skip translations absent from the index
+    :return: The yaml_path and coverage_path that were written
+    """
+    with instrument(ctx, "index"):
+        index = Utils.get_index_from_tags(
+          ctx.obj['new_session'](), Fedora.get_tags_for_fedora_branch(branch))
+
+    with instrument(ctx, "translations"):
+        coverage = Utils.add_translations_to_index(table, index, prune)
+
+    with instrument(ctx, "output"):
+        with click.open_file(yaml_path, 'wb', atomic=True) as yaml_file:
+            yaml_file.write(index.dump_to_string().encode('utf-8'))
+
+    if coverage_path:
+        with click.open_file(coverage_path, 'w', atomic=True) as outfile:
+            Utils.write_translation_coverage(coverage, outfile,
+                                             coverage_format)
 
-    Utils.get_modulemd_translations_from_catalog(catalogs, index)
-    yaml_file.write(index.dump_to_string().encode('utf-8'))
-    print("Wrote modified modulemd-index YAML to %s" % yaml_file.name)
+    return yaml_path, coverage_path
 
 
 if __name__ == "__main__":
@@ -13,11 +13,15 @@
 # For more information on free software, see
 # <https://www.gnu.org/philosophy/free-sw.en.html>.
 
+import io
+import json
 import os
 import sys
+import tempfile
 import unittest
+import xmlrpc.client
 from ModulemdTranslationHelpers import Utils
-from babel.messages import pofile
+from babel.messages import Catalog, pofile
 from six import text_type
 from unittest import mock
 
@@ -197,6 +201,132 @@ class TestTranslationHelpers(TestCase):
                                 profile.get_description(
                                     str(catalog.locale)), msg_string)
 
+    def test_translation_coverage_from_catalog(self):
+        catalogs = list()
+        for locale in ["nl", "fr", "sv"]:
+            with open("%s/test_data/%s.po" % (THIS_DIR, locale), 'r') as infile:
+                catalogs.append(pofile.read_po(infile))
+
+        index = Modulemd.ModuleIndex.new()
+        ret, failures = index.update_from_file(
+            "%s/test_data/f29.yaml" % THIS_DIR, True)
+        self.assertTrue(ret)
+
+        coverage = Utils.get_modulemd_translations_from_catalog(
+            catalogs, index)
+        self.assertListEqual(sorted(coverage.keys()), ["fr", "nl", "sv"])
+
+        totals = dict()
+        for locale, modules in coverage.items():
+            totals[locale] = dict.fromkeys(Utils.COVERAGE_STATES, 0)
+            for string_types in modules.values():
+                for counts in string_types.values():
+                    for state, count in counts.items():
+                        totals[locale][state] += count
+
+        # Coverage is measured against the 106 strings of f29.yaml, so
+        # strings for modules that are not in the index are not counted and
+        # strings without a translation count as missing.
+        self.assertDictEqual(totals["fr"],
+                             {"translated": 106, "fuzzy": 0, "missing": 0})
+        self.assertDictEqual(totals["nl"],
+                             {"translated": 98, "fuzzy": 0, "missing": 8})
+        self.assertDictEqual(coverage["fr"]["ant"]["summary"],
+                             {"translated": 1, "fuzzy": 0, "missing": 0})
+        self.assertNotIn("ghc", coverage["fr"])
+
+    def test_write_translation_coverage(self):
+        coverage = {
+            "fr": {
+                "ant": {
+                    "summary": {"translated": 1, "fuzzy": 0, "missing": 0},
+                    "description": {"translated": 0, "fuzzy": 1,
+                                    "missing": 0},
+                },
+            },
+            "nl": {
+                "avocado": {
+                    "profile": {"translated": 1, "fuzzy": 0, "missing": 2},
+                },
+            },
+        }
+
+        outfile = io.StringIO()
+        Utils.write_translation_coverage(coverage, outfile, "csv")
+        self.assertListEqual(outfile.getvalue().splitlines(), [
+            "locale,module,string_type,translated,fuzzy,missing",
+            "fr,ant,description,0,1,0",
+            "fr,ant,summary,1,0,0",
+            "nl,avocado,profile,1,0,2",
+        ])
+
+        outfile = io.StringIO()
+        Utils.write_translation_coverage(coverage, outfile)
+        self.assertDictEqual(json.loads(outfile.getvalue()), coverage)
+
+    def test_prune_translations_from_catalog(self):
+        index = Modulemd.ModuleIndex.new()
+        ret, failures = index.update_from_file(
+            "%s/test_data/f29.yaml" % THIS_DIR, True)
+        self.assertTrue(ret)
+
+        keys = Utils.get_translation_keys_from_index(index)
+        self.assertIn(("ant", "1.10", None), keys)
+        self.assertNotIn(("ant", "0.1", None), keys)
+
+        catalog = Catalog(locale="fr")
+        catalog.add("Java build tool", "Outil de construction Java",
+                    locations=[("ant;1.10;summary", 1)])
+        catalog.add("Stale summary", "Résumé périmé",
+                    locations=[("ant;0.1;summary", 1)])
+        catalog.add("Stale profile", "Profil périmé",
+                    locations=[("ant;1.10;profile;nonexistent", 3)])
+
+        with self.assertLogs(level='WARNING') as cm:
+            coverage = Utils.get_modulemd_translations_from_catalog(
+                [catalog], index, prune=True)
+        self.assertListEqual(
+            cm.output,
+            ["WARNING:root:Pruned 2 fr strings for modules absent from "
+             "the index"])
+
+        self.assertDictEqual(coverage["fr"]["ant"]["summary"],
+                             {"translated": 1, "fuzzy": 0, "missing": 0})
+        self.assertNotIn("profile", coverage["fr"]["ant"])
+
+        module = index.get_module("ant")
+        self.assertNotIn("0.1", module.get_stream_names())
+        self.assertNotIn("0.1", module.get_translated_streams())
+        self.assertIn("1.10", module.get_translated_streams())
+
+    def test_translation_table_shared_between_indexes(self):
+        catalogs = list()
+        for locale in ["nl", "fr", "sv"]:
+            with open("%s/test_data/%s.po" % (THIS_DIR, locale), 'r') as infile:
+                catalogs.append(pofile.read_po(infile))
+
+        table = Utils.get_translation_table_from_catalogs(catalogs)
+        self.assertIsInstance(table, tuple)
+
+        indexes = list()
+        for i in range(2):
+            index = Modulemd.ModuleIndex.new()
+            ret, failures = index.update_from_file(
+                "%s/test_data/f29.yaml" % THIS_DIR, True)
+            self.assertTrue(ret)
+            indexes.append(index)
+
+        first = Utils.add_translations_to_index(table, indexes[0])
+        second = Utils.add_translations_to_index(table, indexes[1])
+        self.assertEqual(first, second)
+
+        stream = indexes[1].get_module("ant").search_streams("1.10", 0)[0]
+        self.assertEqual(
+            stream.get_summary("fr"),
+            indexes[0].get_module("ant").search_streams(
+                "1.10", 0)[0].get_summary("fr"))
+        self.assertIsNotNone(stream.get_summary("fr"))
+
     @mock.patch('koji.ClientSession')
     def test_index_from_tags(self, mock_session):
         koji_session_mock = KojiSessionMock()
@@ -239,6 +369,37 @@ class TestTranslationHelpers(TestCase):
                          "ant:1.10:20180629154141:819b5873")
         self.assertEqual(stream.get_summary(None), "Java build tool")
 
+    def test_record_and_replay_session(self):
+        koji_session_mock = KojiSessionMock()
+        tags = ['f29']
+
+        with tempfile.TemporaryDirectory() as record_dir:
+            session = Utils.RecordingSession(koji_session_mock, record_dir)
+            recorded = Utils.get_index_from_tags(session, tags)
+            self.assertTrue(len(os.listdir(record_dir)) > 0)
+
+            session = Utils.ReplaySession(record_dir)
+            replayed = Utils.get_index_from_tags(session, tags)
+            self.assertEqual(recorded.dump_to_string(),
+                             replayed.dump_to_string())
+
+            # Calls that were never recorded cannot be replayed
+            with self.assertRaises(KeyError):
+                session.listTagged('f30')
+
+            # Faults are recorded and raised again on replay
+            fault_session = mock.Mock()
+            fault_session.getBuild.side_effect = xmlrpc.client.Fault(
+                1000, "No such build")
+            session = Utils.RecordingSession(fault_session, record_dir)
+            with self.assertRaises(xmlrpc.client.Fault):
+                session.getBuild(3)
+
+            session = Utils.ReplaySession(record_dir)
+            with self.assertRaises(xmlrpc.client.Fault) as cm:
+                session.getBuild(3)
+            self.assertEqual(cm.exception.faultString, "No such build")
+
 
 if __name__ == '__main__':
     unittest.main()